@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import os
+import signal
 import sys
 import time
+import weakref
 
 
 try:
@@ -36,6 +39,110 @@ CSI_ERASE_LINE = "\x1b[2K"
 # useful for partial updates & progress messages as the terminal can display
 # it better.
 CSI_ERASE_LINE_AFTER = "\x1b[K"
+CSI_ERASE_LINE_AFTER_B = CSI_ERASE_LINE_AFTER.encode()
+
+# How often (in seconds) to recheck the terminal width when we can't get
+# notified of resizes via SIGWINCH.
+_COLS_REFRESH_INTERVAL = 0.5
+
+# The minimum time (in seconds) between redraws of the progress lines.
+# Anything faster than ~30Hz isn't perceptible; it just makes more work for us
+# and the terminal.
+_MIN_DRAW_INTERVAL = 0.033
+
+# How often (in seconds) to redraw an idle progress line showing elapsed time.
+_ELAPSED_REFRESH_INTERVAL = 1
+
+
+# Progress instances drawn by the shared ticker.  The ticker is the only thread
+# that updates their counters or writes them out; everyone else just queues up
+# events for it.
+_PROGRESS_REGISTRY = weakref.WeakSet()
+_ticker_lock = _threading.Lock()
+_ticker_wakeup = _threading.Event()
+_ticker_thread = None
+
+
+def _ticker_loop():
+    """Draw all active progress indicators as they change.
+
+    Exits once there are none left.
+    """
+    global _ticker_thread
+    while True:
+        _ticker_wakeup.wait(timeout=_ELAPSED_REFRESH_INTERVAL)
+        _ticker_wakeup.clear()
+        now = time.monotonic()
+        with _ticker_lock:
+            active = list(_PROGRESS_REGISTRY)
+            if not active:
+                _ticker_thread = None
+                return
+        for pm in active:
+            pm._tick(now)
+        # Don't hold on to any of them while we sleep.
+        active = pm = None
+        time.sleep(_MIN_DRAW_INTERVAL)
+
+
+def _wake_ticker(_is_set=_ticker_wakeup.is_set, _set=_ticker_wakeup.set):
+    """Let the ticker know there are new events to draw."""
+    # Checking first avoids the Event's internal lock in the common case where
+    # a wakeup is already pending.
+    if not _is_set():
+        _set()
+
+
+def _start_ticker():
+    """Start the ticker if it isn't running, and wake it up."""
+    global _ticker_thread
+    with _ticker_lock:
+        if _ticker_thread is None or not _ticker_thread.is_alive():
+            _ticker_thread = _threading.Thread(target=_ticker_loop)
+            _ticker_thread.daemon = True
+            _ticker_thread.start()
+    _wake_ticker()
+
+
+def _register(pm):
+    """Add |pm| to the ticker.
+
+    The ticker itself isn't started until there's something to draw.
+    """
+    with _ticker_lock:
+        _PROGRESS_REGISTRY.add(pm)
+
+
+def _unregister(pm):
+    """Remove |pm| from the ticker.
+
+    Once the last one is gone, wait for the ticker to exit so callers can
+    e.g. fork worker processes without a thread running.
+    """
+    with _ticker_lock:
+        _PROGRESS_REGISTRY.discard(pm)
+        thread = None if _PROGRESS_REGISTRY else _ticker_thread
+    if thread is not None and thread is not _threading.current_thread():
+        _ticker_wakeup.set()
+        thread.join()
+
+
+def _winch_handler(pm, prev):
+    """Returns a SIGWINCH handler for |pm| that chains to |prev|.
+
+    The handler only holds a weak reference so the signal module doesn't keep
+    |pm| alive, and it stops refreshing |pm| once it has ended.
+    """
+    ref = weakref.ref(pm)
+
+    def handler(signum, frame):
+        pm = ref()
+        if pm is not None and pm._watch_resize:
+            pm._on_resize()
+        if callable(prev):
+            prev(signum, frame)
+
+    return handler
 
 
 def convert_to_hms(total):
@@ -52,12 +159,13 @@ def duration_str(total):
     uses microsecond resolution.  This makes for noisy output.
     """
     hours, mins, secs = convert_to_hms(total)
-    ret = f"{secs:.3f}s"
-    if mins:
-        ret = f"{mins}m{ret}"
+    parts = []
     if hours:
-        ret = f"{hours}h{ret}"
-    return ret
+        parts.append(f"{hours}h")
+    if mins:
+        parts.append(f"{mins}m")
+    parts.append(f"{secs:.3f}s")
+    return "".join(parts)
 
 
 def elapsed_str(total):
@@ -99,54 +207,204 @@ class Progress:
         self._start = time.time()
         self._show = not delay
         self._units = units
-        self._elide = elide and _TTY
+        # Whether output is suppressed entirely.  When quiet, or not writing to
+        # a terminal, or tracing to stderr (which is set up during option
+        # parsing, so it won't change while we're running), never show any
+        # output and skip as much bookkeeping as possible.
+        self._silent = quiet or not _TTY or IsTraceToStderr()
+        self._elide = elide and not self._silent
+
+        # The title, units, and total never change, so bake them into the
+        # display templates now and leave only the varying fields as slots.
+        title = title.replace("%", "%%")
+        units = units.replace("%", "%%")
+        if total > 0:
+            self._fmt = f"{title}: %2d%% %s(%d{units}/{total}{units})%s %s"
+            self._fmt_end = (
+                f"{title}: %3d%% (%d{units}/{total}{units}), done in %s"
+            )
+        else:
+            self._fmt = f"{title}: %d,"
+            self._fmt_end = f"{title}: %d, done in %s"
+
+        # Each line is written straight to the stderr fd in a single call so
+        # it can't get interleaved with other output.
+        self._stderr_fd = None if self._silent else sys.stderr.fileno()
+        self._os_write = os.write
+
+        # Cache the terminal width rather than querying it on every write.  It
+        # is refreshed on SIGWINCH, or periodically if we can't catch that.
+        self._cols = None
+        self._cols_checked = 0.0
+        self._watch_resize = False
+        self._prev_winch = None
+        self._winch = None
+        if self._elide:
+            self._refresh_cols()
+            if hasattr(signal, "SIGWINCH"):
+                self._prev_winch = signal.getsignal(signal.SIGWINCH)
+                self._winch = _winch_handler(self, self._prev_winch)
+                try:
+                    signal.signal(signal.SIGWINCH, self._winch)
+                    self._watch_resize = True
+                except ValueError:
+                    # Signal handlers can only be set from the main thread.
+                    pass
 
         # Only show the active jobs section if we run more than one in parallel.
         self._show_jobs = False
         self._active = 0
+        # A finished job still counts as active for the line announcing it.
+        self._active_pending = 0
 
         # Save the last message for displaying on refresh.
         self._last_msg = None
+        # When the progress line was last drawn (via time.monotonic).
+        self._last_draw = 0.0
         self._show_elapsed = show_elapsed
-        self._update_event = _threading.Event()
-        self._update_thread = _threading.Thread(
-            target=self._update_loop,
-        )
-        self._update_thread.daemon = True
-
-        # When quiet, never show any output.  It's a bit hacky, but reusing the
-        # existing logic that delays initial output keeps the rest of the class
-        # clean.  Basically we set the start time to years in the future.
-        if quiet:
-            self._show = False
-            self._start += 2**32
-        elif show_elapsed:
-            self._update_thread.start()
-
-    def _update_loop(self):
-        while True:
-            self.update(inc=0)
-            if self._update_event.wait(timeout=1):
-                return
 
-    def _write(self, s):
-        s = "\r" + s
+        # Callers (possibly from multiple threads) queue (inc, msg, active)
+        # events here, and only the ticker (or end()) consumes them and draws.
+        # deque appends & pops are atomic, so producers never need to lock.
+        self._events = collections.deque()
+        self._push = self._events.append
+        # Held by whichever thread is consuming events & drawing.  The ticker
+        # never waits on it; it skips this instance until the next tick.
+        self._draw_lock = _threading.Lock()
+        self._ended = False
+        # Whether the ticker has been started for our events.
+        self._ticking = False
+        # Whether the last draw failed and should be retried.
+        self._redraw = False
+        # An unexpected error from drawing on the ticker, raised from end().
+        self._error = None
+
+        if not self._silent:
+            _register(self)
+            # Show the elapsed time right away, even before any events.
+            if show_elapsed:
+                self._ticking = True
+                _start_ticker()
+
+    def _drain(self):
+        """Applies all queued events.
+
+        Returns:
+            Whether there were any events.
+        """
+        events = self._events
+        if not events:
+            return False
+        # We're the only consumer, so the deque can only grow under us.
+        while events:
+            inc, msg, active = events.popleft()
+            self._active += self._active_pending
+            self._active_pending = 0
+            if active > 0:
+                self._active += active
+                if not self._show_jobs:
+                    self._show_jobs = self._active > 1
+            else:
+                self._active_pending = active
+            self._done += inc
+            if msg is not None:
+                self._last_msg = msg
+        return True
+
+    def _tick(self, now):
+        """Draws any changes.  Called periodically by the ticker thread."""
+        if not self._draw_lock.acquire(blocking=False):
+            return
+        try:
+            if self._ended:
+                return
+            if (
+                self._drain()
+                or self._redraw
+                or (
+                    self._show_elapsed
+                    and now - self._last_draw >= _ELAPSED_REFRESH_INTERVAL
+                )
+            ):
+                try:
+                    self._draw()
+                except OSError:
+                    # e.g. EAGAIN from a non-blocking terminal.  Try again on
+                    # the next pass rather than losing the line.
+                    self._redraw = True
+                else:
+                    self._redraw = False
+                    # Any finished job has been announced now, so it no longer
+                    # counts as active.
+                    self._active += self._active_pending
+                    self._active_pending = 0
+        except Exception as e:
+            # Don't let one bad instance take down the ticker for everyone.
+            # Stop drawing it, and let its owner find out from end().
+            self._error = e
+            _unregister(self)
+        finally:
+            self._draw_lock.release()
+
+    def _refresh_cols(self):
+        self._cols_checked = time.monotonic()
+        try:
+            self._cols = os.get_terminal_size(self._stderr_fd).columns
+        except OSError:
+            # Keep the last known width (if any) rather than failing a write.
+            if self._cols is None:
+                self._cols = 0
+
+    def _on_resize(self):
+        """Called from our SIGWINCH handler."""
+        self._refresh_cols()
+
+    def _write(self, s, newline=False, _monotonic=time.monotonic):
         if self._elide:
-            col = os.get_terminal_size(sys.stderr.fileno()).columns
-            if len(s) > col:
-                s = s[: col - 1] + ".."
-        sys.stderr.write(s)
-        sys.stderr.flush()
+            if (
+                not self._watch_resize
+                and _monotonic() - self._cols_checked > _COLS_REFRESH_INTERVAL
+            ):
+                self._refresh_cols()
+            # Stay off the last column so the cursor doesn't wrap.  A width of 0
+            # means the terminal doesn't know its size, so don't cut anything.
+            col = self._cols
+            if col and len(s) >= col:
+                if col > 2:
+                    s = s[: col - 3] + ".."
+                else:
+                    s = ".."[: col - 1]
+        payload = b"".join(
+            (
+                b"\r",
+                s.encode("utf-8", "replace"),
+                CSI_ERASE_LINE_AFTER_B,
+                b"\n" if newline else b"",
+            )
+        )
+        fd = self._stderr_fd
+        write = self._os_write
+        while payload:
+            payload = payload[write(fd, payload) :]
+
+    def _queue(self, event):
+        """Queues |event| for the ticker to draw."""
+        self._push(event)
+        if self._ticking:
+            _wake_ticker()
+        else:
+            self._ticking = True
+            _start_ticker()
 
     def start(self, name):
-        self._active += 1
-        if not self._show_jobs:
-            self._show_jobs = self._active > 1
-        self.update(inc=0, msg="started " + name)
+        if self._silent:
+            return
+        self._queue((0, "started " + name, 1))
 
     def finish(self, name):
-        self.update(msg="finished " + name)
-        self._active -= 1
+        if self._silent:
+            return
+        self._queue((1, "finished " + name, -1))
 
     def update(self, inc=1, msg=None):
         """Updates the progress indicator.
@@ -155,74 +413,72 @@ class Progress:
             inc: The number of items completed.
             msg: The message to display. If None, use the last message.
         """
-        self._done += inc
-        if msg is None:
-            msg = self._last_msg
-        self._last_msg = msg
-
-        if not _TTY or IsTraceToStderr():
+        if self._silent:
             return
+        self._queue((inc, msg, 0))
 
-        elapsed_sec = time.time() - self._start
+    def _draw(self, _time=time.time, _monotonic=time.monotonic):
+        elapsed_sec = _time() - self._start
         if not self._show:
             if 0.5 <= elapsed_sec:
                 self._show = True
             else:
                 return
+        self._last_draw = _monotonic()
 
         if self._total <= 0:
-            self._write(
-                "%s: %d,%s" % (self._title, self._done, CSI_ERASE_LINE_AFTER)
-            )
+            self._write(self._fmt % self._done)
         else:
             p = (100 * self._done) / self._total
-            if self._show_jobs:
-                jobs = f"[{jobs_str(self._active)}] "
-            else:
-                jobs = ""
+            jobs = f"[{jobs_str(self._active)}] " if self._show_jobs else ""
             if self._show_elapsed:
                 elapsed = f" {elapsed_str(elapsed_sec)} |"
             else:
                 elapsed = ""
             self._write(
-                "%s: %2d%% %s(%d%s/%d%s)%s %s%s"
-                % (
-                    self._title,
-                    p,
-                    jobs,
-                    self._done,
-                    self._units,
-                    self._total,
-                    self._units,
-                    elapsed,
-                    msg,
-                    CSI_ERASE_LINE_AFTER,
-                )
+                self._fmt % (p, jobs, self._done, elapsed, self._last_msg)
             )
 
     def end(self):
-        self._update_event.set()
-        if not _TTY or IsTraceToStderr() or not self._show:
+        if self._silent:
             return
 
-        duration = duration_str(time.time() - self._start)
-        if self._total <= 0:
-            self._write(
-                "%s: %d, done in %s%s\n"
-                % (self._title, self._done, duration, CSI_ERASE_LINE_AFTER)
-            )
-        else:
-            p = (100 * self._done) / self._total
-            self._write(
-                "%s: %3d%% (%d%s/%d%s), done in %s%s\n"
-                % (
-                    self._title,
-                    p,
-                    self._done,
-                    self._units,
-                    self._total,
-                    self._units,
-                    duration,
-                    CSI_ERASE_LINE_AFTER,
+        _unregister(self)
+        if self._watch_resize:
+            self._watch_resize = False
+            # Only put back the old handler if nobody has replaced ours since,
+            # e.g. another elided Progress that is still running.
+            try:
+                if signal.getsignal(signal.SIGWINCH) is self._winch:
+                    signal.signal(
+                        signal.SIGWINCH, self._prev_winch or signal.SIG_DFL
+                    )
+            except ValueError:
+                # Not on the main thread.  Our handler is inert now anyway.
+                pass
+
+        with self._draw_lock:
+            self._ended = True
+            if self._error is not None:
+                raise self._error
+            # Events the ticker never got to still count towards the delay, as
+            # they would have if they'd been drawn.
+            if (
+                self._drain()
+                and not self._show
+                and 0.5 <= time.time() - self._start
+            ):
+                self._show = True
+            if not self._show:
+                return
+
+            duration = duration_str(time.time() - self._start)
+            if self._total <= 0:
+                self._write(
+                    self._fmt_end % (self._done, duration), newline=True
+                )
+            else:
+                p = (100 * self._done) / self._total
+                self._write(
+                    self._fmt_end % (p, self._done, duration), newline=True
                 )
-            )
@@ -0,0 +1,405 @@
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the progress.py module."""
+
+import os
+import signal
+import time
+import unittest
+from unittest import mock
+import weakref
+
+import progress
+
+
+class DurationStrTests(unittest.TestCase):
+    """Check duration_str behavior."""
+
+    def test_duration_str(self):
+        """Check the various unit combinations."""
+        self.assertEqual("0.000s", progress.duration_str(0))
+        self.assertEqual("59.500s", progress.duration_str(59.5))
+        self.assertEqual("1m0.000s", progress.duration_str(60))
+        self.assertEqual("1h0.250s", progress.duration_str(3600.25))
+        self.assertEqual("2h3m4.000s", progress.duration_str(7384))
+
+
+class ProgressTests(unittest.TestCase):
+    """Check Progress output."""
+
+    def setUp(self):
+        mock.patch.object(progress, "_TTY", True).start()
+        self.write = mock.patch.object(progress.Progress, "_write").start()
+        # Keep the shared ticker out of the way so tests can drive it.
+        self.registered = set()
+        mock.patch.object(
+            progress, "_register", side_effect=self.registered.add
+        ).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def lines(self):
+        return [args[0] for args, _ in self.write.call_args_list]
+
+    def test_updates_coalesced(self):
+        """Check queued updates are drawn once per tick."""
+        pm = progress.Progress("Test", 10, delay=False)
+        self.assertIn(pm, self.registered)
+        pm.update(msg="one")
+        pm.update(msg="two")
+        pm.update(inc=0, msg="three")
+        self.write.assert_not_called()
+        pm._tick(time.monotonic())
+        self.assertEqual(["Test: 20% (2/10) three"], self.lines())
+
+    def test_tick_idle(self):
+        """Check nothing is redrawn when nothing changed."""
+        pm = progress.Progress("Test", 10, delay=False)
+        pm.update()
+        pm._tick(time.monotonic())
+        pm._tick(time.monotonic())
+        self.assertEqual(1, self.write.call_count)
+
+    def test_tick_elapsed(self):
+        """Check idle progress showing elapsed time is redrawn every second."""
+        pm = progress.Progress("Test", 10, delay=False, show_elapsed=True)
+        now = time.monotonic()
+        pm._tick(now)
+        pm._tick(now + 0.5)
+        self.assertEqual(1, self.write.call_count)
+        pm._tick(now + 10)
+        self.assertEqual(2, self.write.call_count)
+        self.assertRegex(self.lines()[-1], r"^Test:  0% \(0/10\) 0:00 \| ")
+
+    def test_jobs(self):
+        """Check a finished job counts as active for the line announcing it."""
+        pm = progress.Progress("Test", 10, delay=False)
+        pm.start("a")
+        pm.start("b")
+        pm.finish("a")
+        pm._tick(time.monotonic())
+        pm.update(inc=0)
+        pm._tick(time.monotonic())
+        self.assertEqual(
+            [
+                "Test: 10% [2 jobs] (1/10) finished a",
+                "Test: 10% [1 job] (1/10) finished a",
+            ],
+            self.lines(),
+        )
+
+    def test_draw_retried(self):
+        """Check a failed write is retried on the next tick."""
+        self.write.side_effect = [BlockingIOError, None]
+        pm = progress.Progress("Test", 10, delay=False)
+        pm.update()
+        pm._tick(time.monotonic())
+        pm._tick(time.monotonic())
+        self.assertEqual(["Test: 10% (1/10) None"] * 2, self.lines())
+
+    def test_draw_error(self):
+        """Check unexpected drawing errors are raised from end()."""
+        self.write.side_effect = ValueError("boom")
+        pm = progress.Progress("Test", 10, delay=False)
+        pm.update()
+        with mock.patch.object(progress, "_unregister") as unregister:
+            pm._tick(time.monotonic())
+        unregister.assert_called_once_with(pm)
+        with self.assertRaises(ValueError):
+            pm.end()
+
+    def test_jobs_idle_refresh(self):
+        """Check the next refresh after a finish shows the new job count."""
+        pm = progress.Progress("Test", 10, delay=False, show_elapsed=True)
+        pm.start("a")
+        pm.start("b")
+        pm.finish("a")
+        now = time.monotonic()
+        pm._tick(now)
+        pm._tick(now + 5)
+        self.assertEqual(2, self.write.call_count)
+        self.assertIn("[2 jobs]", self.lines()[0])
+        self.assertIn("[1 job]", self.lines()[1])
+
+    def test_delay(self):
+        """Check output is held back briefly when delayed."""
+        pm = progress.Progress("Test", 10)
+        pm.update()
+        pm._tick(time.monotonic())
+        self.write.assert_not_called()
+        pm._start -= 1
+        pm.update()
+        pm._tick(time.monotonic())
+        self.assertEqual(["Test: 20% (2/10) None"], self.lines())
+
+    def test_end_delayed(self):
+        """Check a delayed summary is shown if updates were never drawn."""
+        pm = progress.Progress("Test", 3)
+        pm._start -= 1
+        pm.update()
+        pm.update()
+        pm.update()
+        pm.end()
+        self.assertEqual(1, self.write.call_count)
+        self.assertRegex(self.lines()[-1], r"^Test: 100% \(3/3\), done in ")
+
+    def test_end_delayed_quick(self):
+        """Check a delayed summary stays hidden if it finished quickly."""
+        pm = progress.Progress("Test", 3)
+        pm.update(inc=3)
+        pm.end()
+        self.write.assert_not_called()
+
+    def test_end(self):
+        """Check the summary line includes pending updates."""
+        pm = progress.Progress("Test", 4, units="KiB", delay=False)
+        pm.update(inc=4)
+        pm.end()
+        self.assertEqual(1, self.write.call_count)
+        self.assertRegex(
+            self.lines()[-1], r"^Test: 100% \(4KiB/4KiB\), done in .*s$"
+        )
+        self.assertEqual({"newline": True}, self.write.call_args[1])
+
+    def test_percent_escaped(self):
+        """Check a % in the title or units survives the templates."""
+        pm = progress.Progress("50% Test", 2, units="%", delay=False)
+        pm.update()
+        pm._tick(time.monotonic())
+        pm.update()
+        pm.end()
+        self.assertEqual("50% Test: 50% (1%/2%) None", self.lines()[0])
+        self.assertRegex(
+            self.lines()[1], r"^50% Test: 100% \(2%/2%\), done in .*s$"
+        )
+        pm = progress.Progress("50% Test", units="%", delay=False)
+        pm.update()
+        pm._tick(time.monotonic())
+        pm.end()
+        self.assertEqual("50% Test: 1,", self.lines()[2])
+        self.assertRegex(self.lines()[3], r"^50% Test: 1, done in .*s$")
+
+    def test_tick_after_end(self):
+        """Check nothing is drawn once the summary line is out."""
+        pm = progress.Progress("Test", 4, delay=False, show_elapsed=True)
+        pm.end()
+        pm.update()
+        pm._tick(time.monotonic() + 10)
+        self.assertEqual(1, self.write.call_count)
+
+    def test_quiet(self):
+        """Check quiet progress never writes anything."""
+        pm = progress.Progress("Test", 2, delay=False, quiet=True)
+        pm.start("a")
+        pm.finish("a")
+        pm.update()
+        pm.end()
+        self.write.assert_not_called()
+        self.assertNotIn(pm, self.registered)
+        self.assertFalse(pm._events)
+
+    def test_not_tty(self):
+        """Check nothing is written when stderr isn't a terminal."""
+        with mock.patch.object(progress, "_TTY", False):
+            pm = progress.Progress(
+                "Test", 2, delay=False, show_elapsed=True, elide=True
+            )
+        pm.update(inc=2)
+        pm.end()
+        self.write.assert_not_called()
+        self.assertNotIn(pm, self.registered)
+
+
+@unittest.skipUnless(hasattr(signal, "SIGWINCH"), "requires SIGWINCH")
+class ResizeTests(unittest.TestCase):
+    """Check tracking of the terminal width."""
+
+    def setUp(self):
+        self.prev = signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+        mock.patch.object(progress, "_TTY", True).start()
+        mock.patch.object(progress, "_register", lambda pm: None).start()
+        self.get_terminal_size = mock.patch(
+            "os.get_terminal_size", return_value=os.terminal_size((80, 24))
+        ).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        signal.signal(signal.SIGWINCH, self.prev)
+
+    def resize(self, cols):
+        self.get_terminal_size.return_value = os.terminal_size((cols, 24))
+        signal.getsignal(signal.SIGWINCH)(signal.SIGWINCH, None)
+
+    def test_resize(self):
+        """Check SIGWINCH refreshes the width and chains to the old handler."""
+        prev = mock.Mock()
+        signal.signal(signal.SIGWINCH, prev)
+        pm = progress.Progress("Test", delay=False, elide=True)
+        self.assertEqual(80, pm._cols)
+        self.resize(40)
+        self.assertEqual(40, pm._cols)
+        prev.assert_called_once_with(signal.SIGWINCH, None)
+        pm.end()
+        self.assertIs(prev, signal.getsignal(signal.SIGWINCH))
+
+    def test_end_out_of_order(self):
+        """Check ending an older Progress leaves a newer one's handler."""
+        first = progress.Progress("First", delay=False, elide=True)
+        second = progress.Progress("Second", delay=False, elide=True)
+        first.end()
+        self.assertIs(second._winch, signal.getsignal(signal.SIGWINCH))
+        self.resize(40)
+        self.assertEqual(80, first._cols)
+        self.assertEqual(40, second._cols)
+        second.end()
+        self.resize(20)
+        self.assertEqual(80, first._cols)
+        self.assertEqual(40, second._cols)
+
+    def test_not_kept_alive(self):
+        """Check the installed handler doesn't keep the Progress alive."""
+        pm = progress.Progress("Test", delay=False, elide=True)
+        ref = weakref.ref(pm)
+        del pm
+        self.assertIsNone(ref())
+        self.resize(40)
+
+    def test_fallback_refresh(self):
+        """Check the width is polled when SIGWINCH can't be caught."""
+        with mock.patch("signal.signal", side_effect=ValueError):
+            pm = progress.Progress("Test", delay=False, elide=True)
+        self.assertFalse(pm._watch_resize)
+        self.get_terminal_size.reset_mock()
+        start = pm._cols_checked
+        with mock.patch.object(pm, "_os_write", return_value=100):
+            pm._write("x", _monotonic=lambda: start + 0.1)
+            self.get_terminal_size.assert_not_called()
+            pm._write("x", _monotonic=lambda: start + 1)
+        self.get_terminal_size.assert_called_once()
+        pm.end()
+
+
+class TickerTests(unittest.TestCase):
+    """Check the shared ticker."""
+
+    def setUp(self):
+        mock.patch.object(progress, "_TTY", True).start()
+        mock.patch.object(
+            progress, "_PROGRESS_REGISTRY", weakref.WeakSet()
+        ).start()
+        mock.patch.object(progress.Progress, "_write").start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_registration(self):
+        """Check progress is drawn by the ticker only until it ends."""
+        pm = progress.Progress("Test", 10, delay=False)
+        self.assertIn(pm, progress._PROGRESS_REGISTRY)
+        pm.end()
+        self.assertNotIn(pm, progress._PROGRESS_REGISTRY)
+
+    def test_lazy_start(self):
+        """Check the ticker starts with the first event, not before."""
+        with mock.patch.object(progress, "_start_ticker") as start_ticker:
+            pm = progress.Progress("Test", 10, delay=False)
+            start_ticker.assert_not_called()
+            pm.update()
+            pm.update()
+            start_ticker.assert_called_once_with()
+        pm.end()
+
+    def test_exits_when_idle(self):
+        """Check the ticker is gone once the last Progress ends."""
+        first = progress.Progress("First", 10, delay=False, show_elapsed=True)
+        second = progress.Progress("Second", 10, delay=False)
+        second.update()
+        thread = progress._ticker_thread
+        self.assertTrue(thread.is_alive())
+        first.end()
+        self.assertTrue(thread.is_alive())
+        second.end()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(progress._ticker_thread)
+
+    def test_restart(self):
+        """Check a ticker that died is started again."""
+        dead = mock.Mock()
+        dead.is_alive.return_value = False
+        with mock.patch.object(progress, "_ticker_thread", dead):
+            with mock.patch.object(progress._threading, "Thread") as thread:
+                pm = progress.Progress("Test", 10, delay=False)
+                pm.update()
+            thread.assert_called_once_with(target=progress._ticker_loop)
+            thread.return_value.start.assert_called_once_with()
+        pm.end()
+
+
+class ProgressWriteTests(unittest.TestCase):
+    """Check the raw bytes Progress writes."""
+
+    def setUp(self):
+        mock.patch.object(progress, "_TTY", True).start()
+        self.os_write = mock.patch(
+            "os.write", side_effect=lambda fd, data: len(data)
+        ).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_write(self):
+        """Check each line goes out in a single write."""
+        pm = progress.Progress("Test", delay=False)
+        pm._write("Test: 1,")
+        pm._write("Test: 1, done", newline=True)
+        self.assertEqual(
+            [
+                mock.call(pm._stderr_fd, b"\rTest: 1,\x1b[K"),
+                mock.call(pm._stderr_fd, b"\rTest: 1, done\x1b[K\n"),
+            ],
+            self.os_write.call_args_list,
+        )
+
+    def test_write_elided(self):
+        """Check long lines are cut to fit the terminal."""
+        pm = progress.Progress("Test", delay=False)
+        pm._elide = True
+        pm._watch_resize = True
+        pm._cols = 10
+        pm._write("0123456789abcdef", newline=True)
+        self.os_write.assert_called_once_with(
+            pm._stderr_fd, b"\r0123456..\x1b[K\n"
+        )
+
+    def test_write_elided_narrow(self):
+        """Check very narrow or unknown widths don't overflow the slicing."""
+        pm = progress.Progress("Test", delay=False)
+        pm._elide = True
+        pm._watch_resize = True
+        pm._cols = 2
+        pm._write("0123456789")
+        pm._cols = 1
+        pm._write("0123456789")
+        pm._cols = 0
+        pm._write("0123456789")
+        self.assertEqual(
+            [
+                mock.call(pm._stderr_fd, b"\r.\x1b[K"),
+                mock.call(pm._stderr_fd, b"\r\x1b[K"),
+                mock.call(pm._stderr_fd, b"\r0123456789\x1b[K"),
+            ],
+            self.os_write.call_args_list,
+        )
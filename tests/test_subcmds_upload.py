@@ -29,42 +29,41 @@ class UnexpectedError(Exception):
 class UploadCommand(unittest.TestCase):
     """Check registered all_commands."""
 
+    @classmethod
+    def setUpClass(cls):
+        cls.cmd = upload.Upload()
+        cls.opt, _ = cls.cmd.OptionParser.parse_args([])
+
     def setUp(self):
-        self.cmd = upload.Upload()
         self.branch = mock.MagicMock()
         self.people = mock.MagicMock()
-        self.opt, _ = self.cmd.OptionParser.parse_args([])
-        mock.patch.object(
-            self.cmd, "_AppendAutoList", return_value=None
-        ).start()
-        mock.patch.object(self.cmd, "git_event_log").start()
 
-    def tearDown(self):
-        mock.patch.stopall()
+    def _patch_cmd(self, side_effect):
+        """Stub out the command internals with _UploadBranch raising."""
+        return mock.patch.multiple(
+            self.cmd,
+            _AppendAutoList=mock.DEFAULT,
+            git_event_log=mock.DEFAULT,
+            _UploadBranch=mock.MagicMock(side_effect=side_effect),
+        )
 
     def test_UploadAndReport_UploadError(self):
         """Check UploadExitError raised when UploadError encountered."""
         side_effect = UploadError("upload error")
-        with mock.patch.object(
-            self.cmd, "_UploadBranch", side_effect=side_effect
-        ):
+        with self._patch_cmd(side_effect):
             with self.assertRaises(upload.UploadExitError):
                 self.cmd._UploadAndReport(self.opt, [self.branch], self.people)
 
     def test_UploadAndReport_GitError(self):
         """Check UploadExitError raised when GitError encountered."""
         side_effect = GitError("some git error")
-        with mock.patch.object(
-            self.cmd, "_UploadBranch", side_effect=side_effect
-        ):
+        with self._patch_cmd(side_effect):
             with self.assertRaises(upload.UploadExitError):
                 self.cmd._UploadAndReport(self.opt, [self.branch], self.people)
 
     def test_UploadAndReport_UnhandledError(self):
         """Check UnexpectedError passed through."""
         side_effect = UnexpectedError("some os error")
-        with mock.patch.object(
-            self.cmd, "_UploadBranch", side_effect=side_effect
-        ):
+        with self._patch_cmd(side_effect):
             with self.assertRaises(type(side_effect)):
                 self.cmd._UploadAndReport(self.opt, [self.branch], self.people)